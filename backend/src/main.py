@@ -1,12 +1,44 @@
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import os
+import logging
+import glob
+import hashlib
+import shutil
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from operator import itemgetter
+import orjson
 import ifcopenshell
 from ifcopenshell.util import element as ifc_element
+from ifcopenshell.util import unit as ifc_unit
 from collections import defaultdict
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+
+logger = logging.getLogger(__name__)
+
+
+# A failed warm-up is logged here; the first request then retries the build
+def _log_warmup_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Pre-warming the elements cache failed", exc_info=task.exception())
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Pre-warm the elements cache so the first request doesn't pay for the traversal
+    warmup = asyncio.create_task(asyncio.to_thread(_get_elements_json)) if IFC_CACHE_PATH is not None else None
+    if warmup is not None:
+        warmup.add_done_callback(_log_warmup_failure)
+    yield
+    if warmup is not None and not warmup.done():
+        warmup.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow React dev server origin
 app.add_middleware(
@@ -20,26 +52,83 @@ app.add_middleware(
 # Hardcoded path to IFC file
 IFC_FILE_PATH = "C:/base_structure.ifc"
 
-# Load model once at startup
-if os.path.exists(IFC_FILE_PATH):
-    model = ifcopenshell.open(IFC_FILE_PATH)
-else:
-    model = None
+# Serve the model from IfcOpenShell's RocksDB encoding (converted once next to the
+# IFC file). Reads are lazy, so memory stays flat for very large models.
+IFC_USE_ROCKSDB = False
 
 
-def _get_element_location(element):
-    if hasattr(element, "ObjectPlacement") and element.ObjectPlacement:
+def _open_model(path):
+    if not IFC_USE_ROCKSDB:
+        return ifcopenshell.open(path)
+    rocksdb_path = path + ".rdb"
+    if not os.path.exists(rocksdb_path) or os.path.getmtime(rocksdb_path) < os.path.getmtime(path):
+        # convert into a scratch directory and only move it into place once complete, so an
+        # interrupted conversion never leaves a database that looks valid
+        tmp_path = rocksdb_path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        ifcopenshell.convert_path_to_rocksdb(path, tmp_path)
+        shutil.rmtree(rocksdb_path, ignore_errors=True)
+        os.replace(tmp_path, rocksdb_path)
+    return ifcopenshell.open(rocksdb_path)
+
+
+# Hash of this module's source and the ifcopenshell version: any change to how the payload
+# is built or how the file is parsed invalidates earlier sidecars
+with open(__file__, "rb") as _source:
+    PAYLOAD_VERSION = hashlib.sha1(_source.read() + ifcopenshell.version.encode()).hexdigest()[:12]
+
+
+CACHE_SUFFIX = ".elements-cache.json"
+
+
+# Sidecar holding the encoded /api/elements payload, keyed by the IFC file's mtime and size
+# and by the payload version
+def _get_cache_path(path):
+    stat = os.stat(path)
+    return f"{path}.{stat.st_mtime_ns}.{stat.st_size}.{PAYLOAD_VERSION}{CACHE_SUFFIX}"
+
+
+def _write_cache(content):
+    tmp_path = IFC_CACHE_PATH + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, IFC_CACHE_PATH)
+    except OSError:
+        # caching is best effort, e.g. on a read-only directory or a full disk
         try:
-            placement = element.ObjectPlacement.RelativePlacement
-            x, y, z = placement.Location.Coordinates
-            return {"x": float(x), "y": float(y), "z": float(z)}
-        except Exception:
-            return None
-    return None
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return
 
+    # sidecars written for earlier versions of the file or code are never read again
+    for stale_path in glob.glob(glob.escape(IFC_FILE_PATH) + ".*" + CACHE_SUFFIX):
+        if stale_path != IFC_CACHE_PATH:
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
 
-def _get_element_level(element):
-    storey = ifc_element.get_container(element)
+
+IFC_CACHE_PATH = _get_cache_path(IFC_FILE_PATH) if os.path.exists(IFC_FILE_PATH) else None
+
+
+def _get_element_location(element):
+    # every IfcBuildingElement declares ObjectPlacement, so no hasattr check
+    placement = element.ObjectPlacement
+    if placement is None:
+        return None
+    try:
+        x, y, z = placement.RelativePlacement.Location.Coordinates
+    except (AttributeError, ValueError):
+        # grid placements have no RelativePlacement; 2D points have no z
+        return None
+    return (float(x), float(y), float(z))
+
+
+# (name, elevation) of a spatial container, or (None, 0.0) if it is not a storey
+def _get_storey_level(storey):
     if storey and storey.is_a("IfcBuildingStorey"):
         return (
             storey.Name,
@@ -48,91 +137,251 @@ def _get_element_level(element):
     return (None, 0.0)
 
 
-def _get_unit():
+def _get_element_level(element):
+    return _get_storey_level(ifc_element.get_container(element))
+
+
+# dimension -> unit type it is measured in
+_DIM_UNIT_TYPES = {1: "LENGTHUNIT", 2: "AREAUNIT", 3: "VOLUMEUNIT"}
+
+
+# project units by UnitType (first assignment wins)
+def _get_units():
     try:
         units = model.by_type("IfcUnitAssignment")[0].Units
-        for u in units:
-            if getattr(u, "UnitType", None) == "LENGTHUNIT":
-                return f"{getattr(u, 'Prefix', None) or ''}{getattr(u, 'Name', '')}"
-    except Exception:
-        return None
-    return None
+    except IndexError:
+        return {}
+    units_by_type = {}
+    for u in units:
+        # only named units carry a UnitType
+        if u.is_a("IfcNamedUnit"):
+            units_by_type.setdefault(u.UnitType, u)
+    return units_by_type
 
 
-# NEW: extract dimension and quantity value from quantity sets (no geometry)
-def _get_element_quantity(element):
-    dim = 1
-    value = None
-    for definition in getattr(element, "IsDefinedBy", []) or []:
-        try:
-            rel_def = definition.RelatingDefinition
-        except Exception:
-            continue
-        if hasattr(rel_def, "is_a") and rel_def.is_a("IfcElementQuantity") and getattr(rel_def, "Quantities", None):
-            for q in rel_def.Quantities:
-                try:
-                    if q.is_a("IfcQuantityVolume"):
-                        return 3, float(q.VolumeValue)
-                    if q.is_a("IfcQuantityArea"):
-                        return 2, float(q.AreaValue)
-                    if q.is_a("IfcQuantityLength"):
-                        return 1, float(q.LengthValue)
-                except Exception:
-                    continue
+# label of a length/area/volume unit, e.g. MILLI METRE -> "MILLIMETRE^1", SQUARE_METRE -> "METRE^2"
+def _get_unit_label(unit, dim):
+    name = (unit.Name or "").upper()
+    for power in ("SQUARE", "CUBIC"):
+        if name.startswith(power):
+            name = name[len(power) + 1:]
+    # only SI units have a Prefix; it applies to the base unit before the power
+    prefix = unit.Prefix if unit.is_a("IfcSIUnit") else None
+    return f"{prefix or ''}{name}^{dim}"
+
+
+# dimension -> unit assigned to the project for it, None if the model assigns none
+def _get_project_units():
+    units = _get_units()
+    return {dim: units.get(unit_type) for dim, unit_type in _DIM_UNIT_TYPES.items()}
+
+
+# dimension -> unit label; area and volume fall back to the length unit when not assigned
+def _get_unit_strings(project_units):
+    length_unit = project_units[1]
+    unit_strings = {}
+    for dim in _DIM_UNIT_TYPES:
+        unit = project_units[dim] or length_unit
+        unit_strings[dim] = _get_unit_label(unit, dim) if unit is not None else None
+    return unit_strings
+
+
+# ifcopenshell's convert() is exact between SI units, and from a known conversion-based
+# unit to an unprefixed SI unit; anything else is left unconverted
+def _can_convert_unit(from_unit, to_unit):
+    if to_unit is None or from_unit.UnitType != to_unit.UnitType or not to_unit.is_a("IfcSIUnit"):
+        return False
+    if from_unit.is_a("IfcSIUnit"):
+        return True
+    return not to_unit.Prefix and from_unit.Name.lower() in ifc_unit.si_conversions
+
+
+# quantity class -> (dimension, value attribute)
+_QTY_DIM = {
+    "IfcQuantityVolume": (3, "VolumeValue"),
+    "IfcQuantityArea": (2, "AreaValue"),
+    "IfcQuantityLength": (1, "LengthValue"),
+}
+
+# representation type -> dimension
+_REP_DIM = {
+    "Curve2D": 2,
+    "GeometricCurveSet": 2,
+    "Annotation2D": 2,
+    "SurfaceModel": 3,
+    "Brep": 3,
+    "AdvancedBrep": 3,
+    "SweptSolid": 3,
+    "CSG": 3,
+    "MappedRepresentation": 3,
+    "Tessellation": 3,
+}
+
+
+# quantities attached to an element through its quantity sets
+def _get_element_quantities(element):
+    return QUANTITIES_BY_ID.get(element.id(), ())
+
+
+# dimension from the highest volume/area/length quantity, else from geometry (cacheable per type)
+def _classify_type_dim(element):
+    dim = None
+    for q in _get_element_quantities(element):
+        qty_dim = _QTY_DIM.get(q.is_a())
+        if qty_dim is not None and (dim is None or qty_dim[0] > dim):
+            dim = qty_dim[0]
+    if dim is not None:
+        return dim
 
     # Otherwise check geometry representations
     try:
-        reps = element.Representation.Representations if element.Representation else []
+        representation = element.Representation
+        reps = representation.Representations if representation else []
     except Exception:
         reps = []
     for rep in reps:
-        rtype = getattr(rep, "RepresentationType", None)
-        if rtype in ["Curve2D", "GeometricCurveSet", "Annotation2D"]:
-            return 2, 1
-        if rtype in ["SurfaceModel", "Brep", "AdvancedBrep", "SweptSolid", "CSG", "MappedRepresentation", "Tessellation"]:
-            return 3, 1
+        dim = _REP_DIM.get(getattr(rep, "RepresentationType", None))
+        if dim is not None:
+            return dim
 
     # Fallback
-    return 1, 1
+    return 1
 
 
-@app.get("/api/elements")
-def get_elements():
-    if model is None:
-        raise HTTPException(status_code=404, detail=f"IFC file not found: {IFC_FILE_PATH}")
+# per-element (quantity value, unit label) of the given dimension, value None if the element has none
+def _extract_value_given_dim(element, dim):
+    for q in _get_element_quantities(element):
+        qty_dim = _QTY_DIM.get(q.is_a())
+        if qty_dim is None or qty_dim[0] != dim:
+            continue
+        try:
+            value = float(getattr(q, qty_dim[1]))
+        except Exception:
+            continue
+        # a quantity may carry its own unit instead of the project one: convert it when
+        # possible, otherwise keep its own label so it stays out of the project-unit totals
+        if q.Unit is None:
+            return value, UNIT_STRINGS[dim]
+        if _can_convert_unit(q.Unit, PROJECT_UNITS[dim]):
+            return ifc_unit.convert_unit(value, q.Unit, PROJECT_UNITS[dim]), UNIT_STRINGS[dim]
+        return value, _get_unit_label(q.Unit, dim)
+    return None, UNIT_STRINGS[dim]
 
-    unit = _get_unit()
-    elements = []
-    type_summary = defaultdict(int)
+
+def _get_levels_sorted():
+    levels = model.by_type("IfcBuildingStorey") or []
+    return sorted(
+        [_get_storey_level(lv) for lv in levels],
+        key=itemgetter(1),
+        reverse=True
+    )
+
+
+# element id -> (storey name, elevation) for directly contained elements
+def _get_containment():
+    containment = {}
+    for rel in model.by_type("IfcRelContainedInSpatialStructure"):
+        level = _get_storey_level(rel.RelatingStructure)
+        for child in rel.RelatedElements:
+            containment.setdefault(child.id(), level)
+    return containment
+
+
+# element id -> quantities of every IfcElementQuantity assigned to it
+def _get_quantities_by_id():
+    quantities_by_id = defaultdict(list)
+    for rel in model.by_type("IfcRelDefinesByProperties"):
+        definitions = rel.RelatingPropertyDefinition
+        if not isinstance(definitions, tuple):  # IFC4 also allows a set of definitions
+            definitions = (definitions,)
+        for definition in definitions:
+            if not definition.is_a("IfcElementQuantity"):
+                continue
+            for obj in rel.RelatedObjects:
+                quantities_by_id[obj.id()].extend(definition.Quantities)
+    return dict(quantities_by_id)
+
+
+# Opens the model and computes the model-wide lookups, once
+def _load_model():
+    global model, PROJECT_UNITS, UNIT_STRINGS, LEVELS_SORTED, LEVEL_NAMES, CONTAINMENT, QUANTITIES_BY_ID
+    model = _open_model(IFC_FILE_PATH)
+    PROJECT_UNITS = _get_project_units()
+    UNIT_STRINGS = _get_unit_strings(PROJECT_UNITS)
+    LEVELS_SORTED = _get_levels_sorted()
+    LEVEL_NAMES = [name for name, _ in LEVELS_SORTED]
+    CONTAINMENT = _get_containment()
+    QUANTITIES_BY_ID = _get_quantities_by_id()
+
+
+model = None
+PROJECT_UNITS = {dim: None for dim in _DIM_UNIT_TYPES}
+UNIT_STRINGS = {dim: None for dim in _DIM_UNIT_TYPES}
+LEVELS_SORTED = []
+LEVEL_NAMES = []
+CONTAINMENT = {}
+QUANTITIES_BY_ID = {}
+
+# Load model once at startup, unless the payload for this exact file and code is already cached.
+# On a cache hit the model is only opened if the sidecar disappears before it is read.
+if IFC_CACHE_PATH is not None and not os.path.exists(IFC_CACHE_PATH):
+    _load_model()
+
+
+def _build_elements():
+    building_elements = model.by_type("IfcBuildingElement") or []
+    n = len(building_elements)
+
+    # per-element columns, zipped into element dicts once at the end
+    xs = [None] * n
+    ys = [None] * n
+    z_rels = [None] * n
+    level_names = [None] * n
+    level_elevations = [None] * n
+    types = [None] * n
+    units = [None] * n
+    values = [None] * n
     type_dim = {}  # cache dimension per IFC type (first instance wins)
-    totals = defaultdict(lambda: defaultdict(float))  # totals[type][level] = sum of values
 
-    for element in model.by_type("IfcBuildingElement") or []:
+    for i, element in enumerate(building_elements):
         loc = _get_element_location(element)
-        level_name, level_elevation = _get_element_level(element)
+        level = CONTAINMENT.get(element.id())
+        if level is None:
+            # not directly contained (e.g. part of an aggregate): walk up to the parent
+            level = _get_element_level(element)
 
-        x, y, z_rel = None, None, None
-        real_world_z = None
-
-        if loc:
-            x, y, z_rel = loc["x"], loc["y"], loc["z"]
-            real_world_z = (level_elevation or 0.0) + (z_rel or 0.0)
+        if loc is not None:
+            xs[i], ys[i], z_rels[i] = loc
+        level_names[i], level_elevations[i] = level
 
+        # NEW: dimension is classified once per type, value is read per element
         elem_type = element.is_a()
-        type_summary[elem_type] += 1
-
-        # NEW: get dimension + value from quantities
-        dim, value = _get_element_quantity(element)
-        if elem_type not in type_dim:
+        dim = type_dim.get(elem_type)
+        if dim is None:
+            dim = _classify_type_dim(element)
             type_dim[elem_type] = dim
+        types[i] = elem_type
+        # keep per-element value for debugging
+        values[i], units[i] = _extract_value_given_dim(element, dim)
 
-        unit_with_dim = f"{(unit or 'METER').upper()}^{dim}" if unit else None
+    type_summary = defaultdict(int)
+    totals = {}  # totals[(type, level)] = sum of values
+    for elem_type, level_name, value, unit in zip(types, level_names, values, units):
+        type_summary[elem_type] += 1
+        # NEW: aggregate totals per type+level if value exists, only for values in the
+        # unit the summary row is labelled with
+        if value is not None and level_name and unit == UNIT_STRINGS[type_dim[elem_type]]:
+            key = (elem_type, level_name)
+            totals[key] = totals.get(key, 0.0) + value
 
-        # NEW: aggregate totals per type+level if value exists
-        if value is not None and level_name:
-            totals[elem_type][level_name] += value
+    # real_world_z = level elevation + z relative to level, for elements with a placement
+    real_world_zs = [
+        level_elevation + z_rel if z_rel is not None else None
+        for level_elevation, z_rel in zip(level_elevations, z_rels)
+    ]
 
-        data = {
+    elements = [
+        {
             "x": x,
             "y": y,
             "z_relative_to_level": z_rel,
@@ -140,40 +389,69 @@ def get_elements():
             "level_name": level_name,
             "level_elevation": level_elevation,
             "type": elem_type,
-            "unit": unit_with_dim,
-            "value": value,  # keep per-element value for debugging
+            "unit": unit,
+            "value": value,
         }
-
-        print(data)  # shows in console
-        elements.append(data)
-
-    # Count distinct levels
-    levels = model.by_type("IfcBuildingStorey") or []
-    levels_sorted = sorted(
-        [(lv.Name, float(lv.Elevation) if lv.Elevation else 0.0) for lv in levels],
-        key=lambda x: x[1],
-        reverse=True
-    )
-    level_names = [name for name, _ in levels_sorted]
+        for x, y, z_rel, real_world_z, level_name, level_elevation, elem_type, unit, value in zip(
+            xs, ys, z_rels, real_world_zs, level_names, level_elevations, types, units, values
+        )
+    ]
 
     # Build grouped summary
+    totals_by_type = defaultdict(dict)
+    for (elem_type, level_name), total in totals.items():
+        totals_by_type[elem_type][level_name] = total
+
     groups = []
     for elem_type, count in type_summary.items():
         dim = type_dim.get(elem_type, 1)
-        unit_with_dim = f"{(unit or 'METER').upper()}^{dim}" if unit else None
         groups.append({
             "type": elem_type,
-            "unit": unit_with_dim,
+            "unit": UNIT_STRINGS[dim],
             "count": count,
-            "totals": totals[elem_type],  # per-level totals
+            "totals": totals_by_type.get(elem_type, {}),  # per-level totals
         })
 
     return {
         "elements": elements,
         "summary": groups,
-        "levels": level_names
+        "levels": LEVEL_NAMES,
+        "length_unit": UNIT_STRINGS[1],  # coordinates are in this unit
     }
 
 
+# The model is loaded once and never mutated, so the response is built and encoded once
+@lru_cache(maxsize=1)
+def _elements_json():
+    if model is None:
+        try:
+            with open(IFC_CACHE_PATH, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # removed since startup, by hand or by another process's stale sweep: rebuild it
+            _load_model()
+    content = orjson.dumps(_build_elements())
+    _write_cache(content)
+    return content
+
+
+_elements_lock = threading.Lock()
+
+
+# Serialise cold builds so the warm-up and early requests share one traversal
+def _get_elements_json():
+    with _elements_lock:
+        return _elements_json()
+
+
+@app.get("/api/elements")
+async def get_elements():
+    if IFC_CACHE_PATH is None:
+        raise HTTPException(status_code=404, detail=f"IFC file not found: {IFC_FILE_PATH}")
+
+    content = await asyncio.to_thread(_get_elements_json)
+    return Response(content=content, media_type="application/json")
+
+
 # Run with:
 # uvicorn src.main:app --reload --host 0.0.0.0 --port 8000
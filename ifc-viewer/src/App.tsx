@@ -24,6 +24,7 @@ type SummaryItem = {
 type BackendResponse = {
   elements: ElementRec[]
   summary?: SummaryItem[]
+  length_unit?: string | null  // unit of x/y/z; element units follow each type's dimension
 }
 
 // ----------------- Fetch -----------------
@@ -215,7 +216,7 @@ function App() {
           modelRef.current = null
         }
 
-        const { elements, summary, num_levels } = await fetchElements()
+        const { elements, summary, num_levels, length_unit } = await fetchElements()
         setElements(elements || [])
         const summaryData = summary && summary.length > 0 ? summary : computeSummary(elements || [])
         setSummary(summaryData)
@@ -240,8 +241,8 @@ function App() {
           return
         }
 
-        // Figure out unit scale (meters) from the first element
-        const scale = unitToMeters(elements[0].unit ?? 'METRE')
+        // Figure out unit scale (meters) from the model's length unit
+        const scale = unitToMeters(length_unit ?? elements[0].unit ?? 'METRE')
 
         // Group by level to keep scene tidy
         const root = new THREE.Group()